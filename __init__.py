@@ -20,7 +20,7 @@ Usage:
     state = replay(logger.session)
 """
 
-from .schema import Session, Event, hash_content, hash_directory
+from .schema import Session, Event, hash_content, hash_content_batch, hash_directory
 from .logger import Logger, TracedLLM
 from .replayer import Replayer, replay, compare_traces
 
@@ -34,5 +34,6 @@ __all__ = [
     "replay",
     "compare_traces",
     "hash_content",
+    "hash_content_batch",
     "hash_directory",
 ]
@@ -0,0 +1,117 @@
+"""
+vtrace - Minimal YAML emitter for trace events
+
+Event shapes are fixed (type, timestamp, input, output, metadata), so we
+skip PyYAML's generic representer/resolver/emitter pipeline and write
+each event straight into a byte buffer. The output is a block-sequence
+item that PyYAML loads back to the same dict.
+"""
+
+import json
+import math
+import re
+
+
+# Strings that are safe to emit as plain (unquoted) scalars
+_PLAIN = re.compile(r"[A-Za-z_][A-Za-z0-9_./-]*")
+
+# Plain scalars that a YAML 1.1 resolver would not read back as strings
+_RESERVED = frozenset((
+    "y", "n", "yes", "no", "on", "off", "true", "false", "null",
+))
+
+# Characters a YAML reader accepts verbatim and never treats as a line break
+_SAFE = "\x20-\x7e\xa0-\u2027\u202a-\ud7ff\ue000-\ufefe\uff00-\ufffd\U00010000-\U0010ffff"
+_UNSAFE = re.compile(f"[^{_SAFE}]")
+_UNSAFE_BLOCK = re.compile(f"[^\t\n{_SAFE}]")
+
+
+def escape_unsafe(text: str) -> str:
+    """
+    Escape characters a YAML reader rejects or treats as line breaks.
+    
+    Only valid inside double-quoted scalars (or JSON strings), where
+    `\\uXXXX` is an escape.
+    """
+    return _UNSAFE.sub(lambda m: f"\\u{ord(m.group()):04x}", text)
+
+
+def _quote(s: str) -> str:
+    """Double-quoted scalar (JSON string escapes are valid YAML)."""
+    return escape_unsafe(json.dumps(s, ensure_ascii=False))
+
+
+def _float(x: float) -> str:
+    if math.isnan(x):
+        return ".nan"
+    if math.isinf(x):
+        return ".inf" if x > 0 else "-.inf"
+    text = repr(x)
+    # YAML 1.1 floats need a dot: 1e-05 -> 1.0e-05
+    if "." not in text:
+        mantissa, _, exp = text.partition("e")
+        text = f"{mantissa}.0e{exp}" if exp else f"{mantissa}.0"
+    return text
+
+
+def _flow(value) -> str:
+    """Flow-style scalar or collection (used inside `{...}` / `[...]`)."""
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        return _float(value)
+    if isinstance(value, str):
+        return _quote(value)
+    if isinstance(value, dict):
+        items = ", ".join(f"{_flow(k)}: {_flow(v)}" for k, v in value.items())
+        return "{" + items + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_flow(v) for v in value) + "]"
+    raise TypeError(f"cannot serialize {type(value).__name__} in trace event")
+
+
+def _literal_ok(s: str) -> bool:
+    """Whether a multi-line string can be emitted as a literal block."""
+    return s[:1] not in ("", " ", "\t", "\n") and not _UNSAFE_BLOCK.search(s)
+
+
+def _literal(s: str, indent: str) -> str:
+    """Literal block scalar (`|`) with the chomping indicator s needs."""
+    body = s.rstrip("\n")
+    trailing = len(s) - len(body)
+    chomp = "-" if trailing == 0 else ("" if trailing == 1 else "+")
+    lines = "".join(
+        f"{indent}{line}\n" if line else "\n" for line in body.split("\n")
+    )
+    return f"|{chomp}\n{lines}" + "\n" * max(trailing - 1, 0)
+
+
+def _value(value, indent: str) -> str:
+    """Scalar or collection following `key: ` in block context."""
+    if isinstance(value, str):
+        if "\n" in value and _literal_ok(value):
+            return _literal(value, indent)
+        if _PLAIN.fullmatch(value) and value.lower() not in _RESERVED:
+            return value + "\n"
+        return _quote(value) + "\n"
+    return _flow(value) + "\n"
+
+
+def dump_event(event_dict: dict, buf: bytearray) -> None:
+    """
+    Append one event to buf as an item of the `events:` sequence.
+
+    Key order follows the schema, so traces stay human-scannable.
+    """
+    parts = []
+    prefix = "- "
+    for key, value in event_dict.items():
+        parts.append(f"{prefix}{key}: {_value(value, '    ')}")
+        prefix = "  "
+    buf += "".join(parts).encode()
@@ -17,6 +17,7 @@ from pathlib import Path
 
 from .schema import Session, hash_directory
 from .logger import Logger
+from .codec import read_header, read_session
 from .replayer import Replayer, compare_traces
 
 
@@ -28,6 +29,7 @@ def cmd_new(args):
         trace_file=args.output,
         initial_context=args.context or "",
     )
+    logger.close()
     print(f"Session created: {logger.session.session_id}")
     print(f"Trace file: {logger.trace_file}")
     return 0
@@ -53,15 +55,16 @@ def cmd_log(args):
         diff = args.data or input("Diff: ")
         logger.log_edit(file_path=file_path, diff=diff)
     
+    logger.close()
     print(f"Event logged. Total events: {logger.event_count}")
     return 0
 
 
 def cmd_replay(args):
     """Replay a session."""
-    logger = Logger.load(args.trace)
+    session = read_session(args.trace)
     
-    with Replayer(logger.session, workspace=args.workspace) as replayer:
+    with Replayer(session, workspace=args.workspace) as replayer:
         if args.step:
             # Interactive step mode
             while True:
@@ -76,7 +79,7 @@ def cmd_replay(args):
                     break
         else:
             state = replayer.replay_all()
-            print(f"Replayed {len(logger.session.events)} events")
+            print(f"Replayed {len(session.events)} events")
             print(f"Files in workspace: {list(state.files.keys())}")
             print(f"Workspace: {replayer.workspace}")
             
@@ -88,8 +91,18 @@ def cmd_replay(args):
 
 def cmd_show(args):
     """Show session contents."""
-    logger = Logger.load(args.trace)
-    s = logger.session
+    if not (args.events or args.verbose):
+        # Header only: don't parse any event bodies
+        header, count = read_header(args.trace)
+        print(f"Session ID: {header.get('session_id')}")
+        print(f"Model: {header.get('model')}")
+        print(f"Codebase hash: {header.get('codebase_hash')}")
+        print(f"Created: {header.get('created_at')}")
+        print(f"Events: {count}")
+        print()
+        return 0
+    
+    s = read_session(args.trace)
     
     print(f"Session ID: {s.session_id}")
     print(f"Model: {s.model}")
@@ -100,7 +113,7 @@ def cmd_show(args):
     
     if args.events or args.verbose:
         for i, e in enumerate(s.events):
-            print(f"[{i}] {e.type} @ {e.timestamp}")
+            print(f"[{i}] {e.type} @ {e.timestamp_iso}")
             if args.verbose:
                 print(f"    Input: {e.input}")
                 print(f"    Output: {str(e.output)[:200]}...")
@@ -111,8 +124,8 @@ def cmd_show(args):
 
 def cmd_diff(args):
     """Compare two sessions."""
-    s1 = Logger.load(args.trace1).session
-    s2 = Logger.load(args.trace2).session
+    s1 = read_session(args.trace1)
+    s2 = read_session(args.trace2)
     
     result = compare_traces(s1, s2)
     
@@ -140,7 +153,7 @@ def main():
     p_new = subparsers.add_parser('new', help='Start new session')
     p_new.add_argument('-m', '--model', default='unknown', help='Model identifier')
     p_new.add_argument('-c', '--codebase', help='Path to codebase')
-    p_new.add_argument('-o', '--output', help='Output trace file')
+    p_new.add_argument('-o', '--output', help='Output trace file (.yaml, .jsonl or .mpk)')
     p_new.add_argument('--context', help='Initial context')
     
     # log
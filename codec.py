@@ -0,0 +1,276 @@
+"""
+vtrace - Trace codecs
+
+On-disk formats for session traces, selected by file suffix:
+
+    .yaml / .yml   YAML document (human-readable, default)
+    .jsonl         JSON lines: header record, then one event per line
+    .mpk           msgpack records, each prefixed by a 4-byte LE length
+
+Every codec writes the session header once and then appends one record
+per event, so the Logger never re-serializes earlier events.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Iterator, Protocol
+import json
+import os
+import pickle
+import struct
+import tempfile
+
+import yaml
+
+from .schema import Session, Event, SafeLoader, SafeDumper
+from ._fastyaml import dump_event
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class TraceCodec(Protocol):
+    """Serializes a session as a header followed by appendable events."""
+
+    def encode_header(self, session: Session) -> bytes:
+        """Session metadata, written once at the start of the file."""
+        ...
+
+    def encode_event(self, event: Event) -> bytes:
+        """One event record, appended after the header."""
+        ...
+
+    def decode_stream(self, fp: BinaryIO) -> Iterator[dict]:
+        """Yield the header dict, then one dict per event."""
+        ...
+
+    def decode_header(self, fp: BinaryIO) -> tuple[dict, int]:
+        """Header dict and event count, without decoding any event."""
+        ...
+
+
+class YAMLCodec:
+    """Single YAML document whose last key is the `events:` sequence."""
+
+    def encode_header(self, session: Session) -> bytes:
+        header = yaml.dump(
+            session.header_dict(), Dumper=SafeDumper,
+            default_flow_style=False, sort_keys=False,
+        )
+        # `events` is always the last key, so appended items extend it
+        return header.encode() + b"events:\n"
+
+    def encode_event(self, event: Event) -> bytes:
+        buf = bytearray()
+        dump_event(event.to_dict(), buf)
+        return bytes(buf)
+
+    def decode_stream(self, fp: BinaryIO) -> Iterator[dict]:
+        data = yaml.load(fp, Loader=SafeLoader)
+        events = data.pop("events", None) or []
+        yield data
+        yield from events
+
+    def decode_header(self, fp: BinaryIO) -> tuple[dict, int]:
+        # Walk parser events: header values are plain strings, and the
+        # items of `events:` are only counted, never constructed. Keys
+        # may follow `events` (Session.to_yaml sorts them).
+        header = {}
+        count = 0
+        key = None
+        depth = 0
+        for ev in yaml.parse(fp, Loader=SafeLoader):
+            if isinstance(ev, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+                if depth == 2 and key == "events":
+                    count += 1
+                depth += 1
+            elif isinstance(ev, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+                depth -= 1
+                if depth == 1:
+                    key = None
+            elif isinstance(ev, (yaml.ScalarEvent, yaml.AliasEvent)):
+                if depth == 2 and key == "events":
+                    count += 1
+                elif depth == 1:
+                    if key is None:
+                        key = ev.value
+                        continue
+                    if key != "events":
+                        # `events:` with no sequence (empty trace)
+                        header[key] = ev.value if isinstance(ev, yaml.ScalarEvent) else None
+                    key = None
+        return header, count
+
+
+class JSONLCodec:
+    """Newline-delimited JSON; uses orjson when it is installed."""
+
+    def _dumps(self, d: dict) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(d, option=orjson.OPT_NON_STR_KEYS) + b"\n"
+        return json.dumps(d, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+    def encode_header(self, session: Session) -> bytes:
+        return self._dumps(session.header_dict())
+
+    def encode_event(self, event: Event) -> bytes:
+        return self._dumps(event.to_dict())
+
+    def decode_stream(self, fp: BinaryIO) -> Iterator[dict]:
+        loads = orjson.loads if orjson is not None else json.loads
+        for line in fp:
+            if line.strip():
+                yield loads(line)
+
+    def decode_header(self, fp: BinaryIO) -> tuple[dict, int]:
+        loads = orjson.loads if orjson is not None else json.loads
+        header = loads(fp.readline())
+        return header, sum(1 for line in fp if line.strip())
+
+
+class MsgpackCodec:
+    """Length-prefixed msgpack records (requires the msgpack package)."""
+
+    _LENGTH = struct.Struct("<I")
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError as e:
+            raise ImportError("msgpack is required for .mpk traces: pip install msgpack") from e
+        self._msgpack = msgpack
+
+    def _pack(self, d: dict) -> bytes:
+        packed = self._msgpack.packb(d, use_bin_type=True)
+        return self._LENGTH.pack(len(packed)) + packed
+
+    def encode_header(self, session: Session) -> bytes:
+        return self._pack(session.header_dict())
+
+    def encode_event(self, event: Event) -> bytes:
+        return self._pack(event.to_dict())
+
+    def decode_stream(self, fp: BinaryIO) -> Iterator[dict]:
+        while True:
+            prefix = fp.read(self._LENGTH.size)
+            if len(prefix) < self._LENGTH.size:
+                return
+            (length,) = self._LENGTH.unpack(prefix)
+            record = fp.read(length)
+            if len(record) < length:
+                # Torn final record (writer interrupted mid-append)
+                return
+            yield self._msgpack.unpackb(record, raw=False, strict_map_key=False)
+
+    def decode_header(self, fp: BinaryIO) -> tuple[dict, int]:
+        records = self.decode_stream(fp)
+        header = next(records)
+        count = 0
+        # Skip event bodies by their length prefixes
+        while len(prefix := fp.read(self._LENGTH.size)) == self._LENGTH.size:
+            (length,) = self._LENGTH.unpack(prefix)
+            fp.seek(length, 1)
+            count += 1
+        return header, count
+
+
+CODECS: dict[str, type] = {
+    ".yaml": YAMLCodec,
+    ".yml": YAMLCodec,
+    ".jsonl": JSONLCodec,
+    ".mpk": MsgpackCodec,
+}
+
+
+def codec_for(path: Path | str) -> TraceCodec:
+    """Pick the codec for a trace file by suffix (YAML if unknown)."""
+    return CODECS.get(Path(path).suffix.lower(), YAMLCodec)()
+
+
+def encode_session(codec: TraceCodec, session: Session) -> bytes:
+    """The whole session as codec would leave it on disk."""
+    return b"".join([
+        codec.encode_header(session),
+        *(event.serialized(codec) for event in session.events),
+    ])
+
+
+def write_session(path: Path | str, session: Session, durable: bool = False) -> None:
+    """
+    Write a complete trace file in one go (format picked by suffix).
+    
+    The file is written to a uniquely named temp file next to its
+    destination and moved into place with os.replace, so readers see
+    either the old trace or the new one, never a partial write, and
+    concurrent writers don't share a temp file. `durable` fsyncs the
+    file before the move and its directory after it.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        # mkstemp creates the file 0600; give it the usual permissions
+        os.chmod(tmp, _file_mode(path))
+        with open(fd, "wb") as fp:
+            fp.write(encode_session(codec_for(path), session))
+            if durable:
+                fp.flush()
+                os.fsync(fp.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    if durable and os.name == "posix":
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def _file_mode(path: Path) -> int:
+    """Mode for a new trace at path: the existing file's, else 0666 & ~umask."""
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except OSError:
+        return 0o666 & ~_UMASK
+
+
+# Read once: os.umask can only be queried by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def read_session(path: Path | str) -> Session:
+    """
+    Load a session from a trace file in any supported format.
+    
+    Decoded records are cached by (path, inode, mtime, size), so
+    reloading an unchanged trace skips the parse. Each call gets its own
+    Session, events and nested dicts: the cache holds the records
+    pickled, and unpickling builds fresh objects.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    # The inode changes on every write_session (os.replace), even
+    # within one mtime tick
+    data, *events = pickle.loads(
+        _read_records(path, st.st_ino, st.st_mtime_ns, st.st_size)
+    )
+    data["events"] = events
+    return Session.from_dict(data)
+
+
+@lru_cache(maxsize=64)
+def _read_records(path: str, ino: int, mtime_ns: int, size: int) -> bytes:
+    """Header and event records of a trace file, pickled."""
+    with open(path, "rb") as fp:
+        records = list(codec_for(path).decode_stream(fp))
+    return pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_header(path: Path | str) -> tuple[dict, int]:
+    """Session header and event count, without loading the events."""
+    with open(path, "rb") as fp:
+        return codec_for(path).decode_header(fp)
@@ -78,6 +78,7 @@ def main():
     print("    Logged: Edit (calc.py updated)")
     
     print(f"\n    Total events: {logger.event_count}")
+    logger.flush()
     
     # 3. Show the trace file
     print("\n[3] Trace file contents:")
@@ -4,13 +4,24 @@ vtrace - Event Logger
 Captures events and appends to the session trace.
 """
 
-from datetime import datetime
 from pathlib import Path
+import threading
+import atexit
+import queue
 import json
-import yaml
+import time
+import io
 import os
 
-from .schema import Session, Event, hash_content, hash_directory
+from .schema import Session, Event, hash_content, hash_directory, _intern
+from .codec import codec_for, read_session, write_session
+
+
+# Write buffer for the trace file (128 KiB soft cap)
+BUFFER_SIZE = 128 * 1024
+
+# Queue item asking the writer thread to flush without waiting on it
+_END_OF_BATCH = object()
 
 
 class Logger:
@@ -18,15 +29,57 @@ class Logger:
     Append-only event logger.
     
     Maintains the invariant: all non-deterministic outputs are captured.
+    
+    The trace file is written once (header + existing events) when the
+    logger is created; each new event is then appended as one record in
+    the format chosen by the file suffix (see `vtrace.codec`).
+    
+    Appends are buffered and flushed every `flush_interval_events`
+    events or `flush_interval_seconds` seconds, whichever comes first,
+    or right after an event logged with `end_of_batch=True`.
+    With `async_persist` (the default) a background thread does the
+    writing, so `log_*` calls return without touching the disk. Call
+    `flush()` or `close()` (or use the logger as a context manager) to
+    force the trace to disk.
+    
+    Flushes hand the data to the OS, which is enough to survive a crash
+    of this process. Pass `durable=True` to also fsync on every flush,
+    which guards against power loss but costs a disk round trip.
     """
     
-    def __init__(self, session: Session, trace_file: Path | str | None = None):
+    def __init__(
+        self,
+        session: Session,
+        trace_file: Path | str | None = None,
+        flush_interval_events: int = 32,
+        flush_interval_seconds: float = 1.0,
+        async_persist: bool = True,
+        durable: bool = False,
+    ):
         self.session = session
         self.trace_file = Path(trace_file) if trace_file else None
+        self.flush_interval_events = flush_interval_events
+        self.flush_interval_seconds = flush_interval_seconds
+        self.durable = durable
+        self._fp: io.BufferedWriter | None = None
+        self._codec = codec_for(self.trace_file) if self.trace_file else None
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._queue: queue.SimpleQueue | None = None
+        self._thread: threading.Thread | None = None
+        self._error: Exception | None = None
+        self._closed = False
         
         if self.trace_file:
             self.trace_file.parent.mkdir(parents=True, exist_ok=True)
-            self._save()
+            self._open()
+            if async_persist:
+                self._queue = queue.SimpleQueue()
+                self._thread = threading.Thread(
+                    target=self._persist_loop, name="vtrace-persist", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
     
     @classmethod
     def new_session(
@@ -57,33 +110,139 @@ class Logger:
     @classmethod
     def load(cls, trace_file: str | Path) -> "Logger":
         """Load existing session from trace file."""
-        trace_file = Path(trace_file)
-        with open(trace_file) as f:
-            data = yaml.safe_load(f)
-        session = Session.from_dict(data)
+        session = read_session(trace_file)
         return cls(session, trace_file)
     
-    def _save(self) -> None:
-        """Persist session to disk."""
-        if self.trace_file:
-            with open(self.trace_file, 'w') as f:
-                yaml.dump(self.session.to_dict(), f, default_flow_style=False, sort_keys=False)
+    def _open(self) -> None:
+        """Write the session snapshot and keep the file open for appends."""
+        # Atomic, so reopening an existing trace can't truncate it
+        write_session(self.trace_file, self.session, durable=self.durable)
+        self._fp = io.BufferedWriter(
+            io.FileIO(self.trace_file, 'a'), buffer_size=BUFFER_SIZE
+        )
+    
+    def _append_event(self, event: Event, end_of_batch: bool = False) -> None:
+        """Append event to the session and the trace file."""
+        if self._closed:
+            raise ValueError("I/O operation on closed logger")
+        # Encode on the caller's thread, so an event that can't be
+        # serialized raises here instead of being dropped from the file
+        data = event.serialized(self._codec) if self._fp is not None else None
+        self.session.append(event)
+        if self._queue is not None:
+            self._queue.put(data)
+            if end_of_batch:
+                self._queue.put(_END_OF_BATCH)
+        elif self._fp is not None:
+            self._write_event(data)
+            if end_of_batch:
+                self._sync()
+    
+    def _write_event(self, data: bytes) -> None:
+        self._fp.write(data)
+        self._pending += 1
+        if (self._pending >= self.flush_interval_events
+                or time.monotonic() - self._last_flush >= self.flush_interval_seconds):
+            self._sync()
+    
+    def _sync(self) -> None:
+        self._fp.flush()
+        if self.durable:
+            os.fsync(self._fp.fileno())
+        self._pending = 0
+        self._last_flush = time.monotonic()
+    
+    def _persist_loop(self) -> None:
+        """
+        Background writer.
+        
+        Queue items are encoded events to append, a threading.Event
+        requesting a flush (set once done), _END_OF_BATCH requesting a
+        flush, or None to stop. The first write error is kept for
+        `flush()` to raise, and nothing more is written after it so the
+        file never skips an event.
+        """
+        while True:
+            timeout = None
+            if self._pending:
+                timeout = max(self._last_flush + self.flush_interval_seconds - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = threading.Event()
+            if item is None:
+                return
+            if self._error is None:
+                try:
+                    if isinstance(item, bytes):
+                        self._write_event(item)
+                    else:
+                        self._sync()
+                except Exception as e:
+                    self._error = e
+            if isinstance(item, threading.Event):
+                item.set()
+    
+    def flush(self) -> None:
+        """
+        Write all logged events to the trace file.
+        
+        The data is handed to the OS; it is also fsynced only when the
+        logger was created with `durable=True`.
+        """
+        if self._fp is None:
+            return
+        if self._queue is None:
+            self._sync()
+            return
+        
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+        if self._error is not None:
+            raise self._error
+    
+    def close(self) -> None:
+        """Flush and close the trace file. Logging afterwards raises."""
+        self._closed = True
+        if self._fp is None:
+            return
+        try:
+            self.flush()
+        finally:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._queue = self._thread = None
+                atexit.unregister(self.close)
+            self._fp.close()
+            self._fp = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
     
-    def _now(self) -> str:
-        return datetime.utcnow().isoformat()
+    def _now(self) -> int:
+        return time.time_ns()
     
     def log_llm_call(
         self,
         prompt: str,
         response: str,
         temperature: float = 0.0,
+        end_of_batch: bool = False,
         **kwargs
     ) -> Event:
         """
         Log an LLM call.
         
         Captures the full response (non-deterministic output).
+        Pass `end_of_batch=True` on the last event of a burst to have
+        it flushed to disk without waiting for the flush thresholds.
         """
+        response_hash = hash_content(response)
         event = Event(
             type="llm_call",
             timestamp=self._now(),
@@ -91,12 +250,13 @@ class Logger:
             output=response,
             metadata={
                 "temperature": temperature,
-                "response_hash": hash_content(response),
-                **kwargs
+                "response_hash": response_hash,
+                **kwargs,
+                # After kwargs: compare_traces relies on this digest
+                "content_hash": response_hash,
             }
         )
-        self.session.append(event)
-        self._save()
+        self._append_event(event, end_of_batch)
         return event
     
     def log_tool_call(
@@ -104,6 +264,7 @@ class Logger:
         tool_name: str,
         args: dict | str,
         output: str,
+        end_of_batch: bool = False,
         **kwargs
     ) -> Event:
         """
@@ -112,18 +273,18 @@ class Logger:
         event = Event(
             type="tool_call",
             timestamp=self._now(),
-            input={"tool": tool_name, "args": args},
+            input={"tool": _intern(tool_name), "args": args},
             output=output,
-            metadata=kwargs
+            metadata={**kwargs, "content_hash": hash_content(output)}
         )
-        self.session.append(event)
-        self._save()
+        self._append_event(event, end_of_batch)
         return event
     
     def log_edit(
         self,
         file_path: str,
         diff: str,
+        end_of_batch: bool = False,
         **kwargs
     ) -> Event:
         """
@@ -134,10 +295,9 @@ class Logger:
             timestamp=self._now(),
             input=file_path,
             output=diff,
-            metadata=kwargs
+            metadata={**kwargs, "content_hash": hash_content(diff)}
         )
-        self.session.append(event)
-        self._save()
+        self._append_event(event, end_of_batch)
         return event
     
     @property
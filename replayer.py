@@ -10,65 +10,116 @@ We replay the recorded outputs deterministically.
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Callable
+from bisect import bisect_right
+from operator import attrgetter
 import subprocess
+import hashlib
 import tempfile
 import shutil
 import os
 
-from .schema import Session, Event
+from .schema import Session, Event, canonical_bytes, hash_content
 
 
-@dataclass
+@dataclass(slots=True)
 class ReplayState:
     """
     State maintained during replay.
     
-    Represents the codebase at any point in the trace.
+    Represents the codebase at any point in the trace. File changes
+    are kept in memory and only written to the workspace by
+    `flush_to_disk()`, so a file edited many times is written once.
     """
     workspace: Path
     files: dict[str, str] = field(default_factory=dict)
     llm_outputs: list[str] = field(default_factory=list)
     tool_outputs: list[str] = field(default_factory=list)
     event_index: int = 0
+    dirty: set[str] = field(default_factory=set, repr=False, compare=False)
+    _seen_dirs: set[Path] = field(default_factory=set, repr=False, compare=False)
+    _content_pool: dict[str, str] = field(default_factory=dict, repr=False, compare=False)
     
     def get_file(self, path: str) -> str | None:
         return self.files.get(path)
     
     def set_file(self, path: str, content: str) -> None:
         self.files[path] = content
-        # Also write to workspace
-        fpath = self.workspace / path
-        fpath.parent.mkdir(parents=True, exist_ok=True)
-        fpath.write_text(content)
+        self.dirty.add(path)
+    
+    def remove_file(self, path: str) -> None:
+        self.files.pop(path, None)
+        self.dirty.add(path)
+    
+    def state_hash(self) -> str:
+        """
+        Hash of the replayed state: file contents and recorded outputs.
+        
+        The workspace location is excluded, so replays of the same trace
+        into different directories hash equal.
+        """
+        return hash_content(canonical_bytes({
+            "files": self.files,
+            "llm_outputs": self.llm_outputs,
+            "tool_outputs": self.tool_outputs,
+        }))
+    
+    def intern_files(self) -> None:
+        """
+        Make files with identical contents share one string object.
+        
+        Called when checkpointing, so a file that returns to an earlier
+        state (e.g. a reverted edit) is stored once across snapshots.
+        """
+        pool = self._content_pool
+        for path, content in self.files.items():
+            self.files[path] = pool.setdefault(content, content)
+    
+    def flush_to_disk(self) -> None:
+        """Write every file changed since the last flush to the workspace."""
+        for path in self.dirty:
+            fpath = self.workspace / path
+            content = self.files.get(path)
+            if content is None:
+                fpath.unlink(missing_ok=True)
+                continue
+            if fpath.parent not in self._seen_dirs:
+                fpath.parent.mkdir(parents=True, exist_ok=True)
+                self._seen_dirs.add(fpath.parent)
+            fpath.write_text(content)
+        self.dirty.clear()
 
 
 def apply_diff(content: str, diff: str) -> str:
     """
     Apply a unified diff to content.
     
-    Simplified: handles basic +/- line format.
+    Simplified: the `+` lines of the diff become the new content; a diff
+    with no `+` lines leaves content unchanged. Hunk headers, context and
+    `-` lines don't affect the result, so they are skipped without
+    searching content for them.
     For production, use proper diff library.
+    
+    The per-line work is done by C-level str methods rather than a
+    Python loop over every diff line.
     """
-    lines = content.split('\n') if content else []
-    result = []
-    
-    for diff_line in diff.split('\n'):
-        if diff_line.startswith('@@'):
-            continue
-        elif diff_line.startswith('-') and not diff_line.startswith('---'):
-            # Remove line (skip it in output)
-            old_line = diff_line[1:].strip()
-            # Find and remove from lines
-            for i, line in enumerate(lines):
-                if line.strip() == old_line:
-                    lines.pop(i)
-                    break
-        elif diff_line.startswith('+') and not diff_line.startswith('+++'):
-            # Add line
-            result.append(diff_line[1:])
-        elif not diff_line.startswith('\\'):
-            # Context line
-            pass
+    # `+++` file headers look like adds; only filter them if present
+    has_headers = diff[:3] == '+++' or '\n+++' in diff
+    
+    # No adds at all (context/removal-only diff): nothing to build
+    if diff[:1] != '+' and '\n+' not in diff:
+        return content
+    
+    # Fast path: every line is an add (the usual shape of logged edits)
+    if (not has_headers and diff[:1] == '+'
+            and diff.count('\n') == diff.count('\n+')):
+        return diff[1:].replace('\n+', '\n')
+    
+    # Splitting on "\n+" yields one chunk per `+` line (plus whatever
+    # non-add lines follow it); the add is the chunk's first line.
+    chunks = ('\n' + diff).split('\n+')[1:]
+    result = [chunk.partition('\n')[0] for chunk in chunks]
+    if has_headers:
+        result = [line for line in result if line[:2] != '++']
     
     # Simple approach: just use the + lines as new content
     if result:
@@ -91,8 +142,14 @@ class Replayer:
         Therefore, fold(Apply, C₀, Σ) is deterministic.
     """
     
-    def __init__(self, session: Session, workspace: Path | str | None = None):
+    def __init__(
+        self,
+        session: Session,
+        workspace: Path | str | None = None,
+        checkpoint_interval: int = 64,
+    ):
         self.session = session
+        self.checkpoint_interval = checkpoint_interval
         
         if workspace:
             self.workspace = Path(workspace)
@@ -108,6 +165,69 @@ class Replayer:
             "tool_call": self._apply_tool_call,
             "edit": self._apply_edit,
         }
+        
+        # (event_index, files, len(llm_outputs), len(tool_outputs)).
+        # Replay is deterministic and the output lists are append-only,
+        # so any run's outputs are a prefix of the longest run seen and
+        # lengths are enough to restore them. File contents are shared
+        # with the live state, not copied.
+        self._checkpoints: list[tuple[int, dict[str, str], int, int]] = []
+        self._llm_history: list[str] = []
+        self._tool_history: list[str] = []
+        self._checkpoint()
+        
+        # prompt key -> recorded response, built on first lookup
+        self._llm_cache: dict[str, str] | None = None
+    
+    def _checkpoint(self) -> None:
+        state = self.state
+        state.intern_files()
+        self._checkpoints.append((
+            state.event_index,
+            dict(state.files),
+            len(state.llm_outputs),
+            len(state.tool_outputs),
+        ))
+    
+    def _restore(self, checkpoint: tuple[int, dict[str, str], int, int]) -> None:
+        """Reset state to a checkpoint."""
+        index, files, n_llm, n_tool = checkpoint
+        state = self.state
+        for path in list(state.files):
+            if path not in files:
+                state.remove_file(path)
+        for path, content in files.items():
+            if state.files.get(path) is not content:
+                state.set_file(path, content)
+        if len(state.llm_outputs) > len(self._llm_history):
+            self._llm_history = state.llm_outputs
+        if len(state.tool_outputs) > len(self._tool_history):
+            self._tool_history = state.tool_outputs
+        state.llm_outputs = self._llm_history[:n_llm]
+        state.tool_outputs = self._tool_history[:n_tool]
+        state.event_index = index
+    
+    def _llm_key(self, prompt: str, temperature: float) -> str:
+        # float() so a call logged with temperature=0 matches 0.0
+        key = f"{self.session.model}|{float(temperature)}|{prompt}"
+        return hashlib.sha256(key.encode()).hexdigest()
+    
+    def llm_response(self, prompt: str, temperature: float = 0.0) -> str | None:
+        """
+        Recorded response for a prompt, or None if it was never sent.
+        
+        Lets code that calls the model be re-run against the trace:
+        responses are served from a dict keyed by sha256(model,
+        temperature, prompt), built once over the trace. For a prompt
+        sent more than once, the first recorded response is returned.
+        """
+        if self._llm_cache is None:
+            self._llm_cache = {}
+            for event in self.session.events:
+                if event.type == "llm_call":
+                    key = self._llm_key(event.input, event.metadata.get("temperature", 0.0))
+                    self._llm_cache.setdefault(key, event.output)
+        return self._llm_cache.get(self._llm_key(prompt, temperature))
     
     def _apply_llm_call(self, event: Event, state: ReplayState) -> None:
         """
@@ -151,6 +271,9 @@ class Replayer:
             handler(event, self.state)
         
         self.state.event_index += 1
+        if (self.state.event_index % self.checkpoint_interval == 0
+                and self.state.event_index > self._checkpoints[-1][0]):
+            self._checkpoint()
         return event
     
     def replay_all(self) -> ReplayState:
@@ -159,8 +282,23 @@ class Replayer:
         
         Returns final state.
         """
-        while self.step() is not None:
-            pass
+        # Same as calling step() until exhausted, with the per-event
+        # lookups hoisted out of the loop
+        events = self.session.events
+        handlers = self.handlers
+        state = self.state
+        interval = self.checkpoint_interval
+        last_checkpoint = self._checkpoints[-1][0]
+        for index in range(state.event_index, len(events)):
+            event = events[index]
+            handler = handlers.get(event.type)
+            if handler:
+                handler(event, state)
+            state.event_index = index + 1
+            if (index + 1) % interval == 0 and index + 1 > last_checkpoint:
+                self._checkpoint()
+                last_checkpoint = index + 1
+        self.flush()
         return self.state
     
     def replay_to(self, index: int) -> ReplayState:
@@ -168,12 +306,27 @@ class Replayer:
         Replay up to (but not including) event at index.
         
         Useful for debugging: "what was state before event N?"
+        
+        Seeks from the nearest checkpoint at or before index, so moving
+        backwards or jumping ahead replays at most checkpoint_interval
+        events instead of the whole prefix. Negative indices seek to
+        the start of the trace.
         """
+        index = max(index, 0)
+        pos = bisect_right(self._checkpoints, index, key=lambda c: c[0]) - 1
+        nearest = self._checkpoints[pos]
+        if index < self.state.event_index or nearest[0] > self.state.event_index:
+            self._restore(nearest)
+        
         while self.state.event_index < index:
             if self.step() is None:
                 break
         return self.state
     
+    def flush(self) -> None:
+        """Write pending file changes to the workspace."""
+        self.state.flush_to_disk()
+    
     def cleanup(self) -> None:
         """Clean up temporary workspace."""
         if self._temp_dir and os.path.exists(self._temp_dir):
@@ -183,6 +336,8 @@ class Replayer:
         return self
     
     def __exit__(self, *args):
+        if self._temp_dir is None:
+            self.flush()
         self.cleanup()
 
 
@@ -198,10 +353,26 @@ def replay(session: Session, workspace: Path | str | None = None) -> ReplayState
         return r.replay_all()
 
 
+_get_type = attrgetter("type")
+
+
+def _same_output(e1: Event, e2: Event) -> bool:
+    """Compare outputs by their logged content hashes when both have one."""
+    h1 = e1.metadata.get("content_hash")
+    h2 = e2.metadata.get("content_hash")
+    if h1 is not None and h2 is not None:
+        return h1 == h2
+    return e1.output == e2.output
+
+
 def compare_traces(s1: Session, s2: Session) -> dict:
     """
     Compare two session traces.
     
+    Outputs are compared via the `content_hash` recorded at log time,
+    so matching events cost a short string compare regardless of how
+    large the output is.
+    
     Returns dict describing differences.
     """
     diffs = {
@@ -210,14 +381,28 @@ def compare_traces(s1: Session, s2: Session) -> dict:
         "event_diffs": []
     }
     
-    for i, (e1, e2) in enumerate(zip(s1.events, s2.events)):
+    n = min(len(s1.events), len(s2.events))
+    events1, events2 = s1.events[:n], s2.events[:n]
+    
+    # Common case: traces agree. Compare the type and hash columns as
+    # whole lists (C-level, short-circuits on the first difference)
+    # before falling back to the per-event walk that reports diffs.
+    hashes1 = [e.metadata.get("content_hash") for e in events1]
+    if (
+        list(map(_get_type, events1)) == list(map(_get_type, events2))
+        and None not in hashes1
+        and hashes1 == [e.metadata.get("content_hash") for e in events2]
+    ):
+        return diffs
+    
+    for i, (e1, e2) in enumerate(zip(events1, events2)):
         if e1.type != e2.type:
             diffs["event_diffs"].append({
                 "index": i,
                 "type": "type_mismatch",
                 "values": (e1.type, e2.type)
             })
-        elif e1.output != e2.output:
+        elif not _same_output(e1, e2):
             diffs["event_diffs"].append({
                 "index": i,
                 "type": "output_mismatch",
@@ -4,34 +4,177 @@ vtrace - Reproducible traces for AI-assisted coding
 Core schema definitions for the event trace system.
 """
 
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field
 from typing import Literal, Any
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import json
+import os
+import sys
+import warnings
+
+import yaml
+
+from ._fastyaml import escape_unsafe
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# libyaml-backed loader/dumper, shared by every YAML read and write
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    warnings.warn(
+        "PyYAML was built without libyaml; loading YAML traces will be slow",
+        RuntimeWarning,
+    )
+    from yaml import SafeLoader, SafeDumper
+
+
+# Read size when hashing files. Large updates keep OpenSSL's SHA256
+# (SHA-NI / ARMv8 crypto extensions where available) throughput-bound
+# rather than call-overhead-bound.
+HASH_CHUNK_SIZE = 1 << 20
 
 
 EventType = Literal["llm_call", "tool_call", "edit"]
 
 
-@dataclass
+def _intern(value):
+    """
+    Intern low-cardinality strings (event types, model names).
+    
+    Decoders hand back a fresh str per record; interning makes the
+    copies share one object, so comparisons hit the identity fast path.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _parse_timestamp(ts: Any) -> Any:
+    """Convert an ISO-8601 timestamp (older traces) to ns since epoch."""
+    if isinstance(ts, str):
+        try:
+            ts = datetime.fromisoformat(ts)
+        except ValueError:
+            return ts
+    if isinstance(ts, datetime):
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        delta = ts - _EPOCH
+        return (delta.days * 86_400 + delta.seconds) * 10**9 + delta.microseconds * 1000
+    return ts
+
+
+@dataclass(slots=True, frozen=True)
 class Event:
-    """A single event in the trace."""
+    """
+    A single event in the trace.
+    
+    `timestamp` is nanoseconds since the epoch (UTC); use
+    `timestamp_iso` for display.
+    
+    Events are frozen but not hashable: input/output/metadata may be
+    dicts, so the field hash dataclass would generate always fails.
+    """
+    __hash__ = None
+    
     type: EventType
-    timestamp: str
+    timestamp: int
     input: Any
     output: Any
     metadata: dict = field(default_factory=dict)
+    _serialized: dict | None = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        object.__setattr__(self, "type", _intern(self.type))
+        # Events are immutable, so each codec's encoding (and the
+        # canonical bytes used for hashing) only need computing once.
+        # The cache dict is created on first use: replay and compare
+        # never serialize, so loaded events shouldn't pay for it.
+        object.__setattr__(self, "_serialized", None)
     
     def to_dict(self) -> dict:
-        return asdict(self)
+        # Plain literal: asdict() would deep-copy input/output/metadata
+        return {
+            "type": self.type,
+            "timestamp": self.timestamp,
+            "input": self.input,
+            "output": self.output,
+            "metadata": self.metadata,
+        }
+    
+    def _cache(self) -> dict:
+        cache = self._serialized
+        if cache is None:
+            cache = {}
+            object.__setattr__(self, "_serialized", cache)
+        return cache
+    
+    def serialized(self, codec) -> bytes:
+        """This event encoded by codec, memoized per codec type."""
+        cache = self._cache()
+        data = cache.get(type(codec))
+        if data is None:
+            data = cache[type(codec)] = codec.encode_event(self)
+        return data
+    
+    def canonical(self) -> bytes:
+        """`canonical_bytes` of this event, memoized with the encodings."""
+        cache = self._cache()
+        data = cache.get(canonical_bytes)
+        if data is None:
+            data = cache[canonical_bytes] = canonical_bytes(self.to_dict())
+        return data
+    
+    def __getstate__(self):
+        # Pickle the fields only; the encoding cache is rebuilt on demand
+        return (self.type, self.timestamp, self.input, self.output, self.metadata)
+    
+    def __setstate__(self, state):
+        setattr_ = object.__setattr__
+        for name, value in zip(("type", "timestamp", "input", "output", "metadata"), state):
+            setattr_(self, name, value)
+        setattr_(self, "type", _intern(self.type))
+        setattr_(self, "_serialized", None)
+    
+    @property
+    def timestamp_iso(self) -> str:
+        """Timestamp as an ISO-8601 string (UTC)."""
+        if not isinstance(self.timestamp, int):
+            return str(self.timestamp)
+        seconds, ns = divmod(self.timestamp, 10**9)
+        dt = datetime.fromtimestamp(seconds, tz=timezone.utc)
+        return dt.replace(microsecond=ns // 1000).isoformat()
     
     @classmethod
     def from_dict(cls, d: dict) -> "Event":
-        return cls(**d)
+        # Hot path when loading large traces: fill the slots directly
+        # instead of going through the generated __init__.
+        timestamp = d["timestamp"]
+        if not isinstance(timestamp, int):
+            timestamp = _parse_timestamp(timestamp)
+        type_ = _intern(d["type"])
+        input_ = d["input"]
+        if type_ == "tool_call" and isinstance(input_, dict) and "tool" in input_:
+            input_["tool"] = _intern(input_["tool"])
+        obj = object.__new__(cls)
+        setattr_ = object.__setattr__
+        setattr_(obj, "type", type_)
+        setattr_(obj, "timestamp", timestamp)
+        setattr_(obj, "input", input_)
+        setattr_(obj, "output", d["output"])
+        setattr_(obj, "metadata", d.get("metadata") or {})
+        setattr_(obj, "_serialized", None)
+        return obj
 
 
-@dataclass
+@dataclass(slots=True)
 class Session:
     """
     A reproducible session: S = (M, P₀, Σ, C₀)
@@ -48,24 +191,93 @@ class Session:
     initial_context: str = ""
     events: list[Event] = field(default_factory=list)
     created_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+    _hasher: Any = field(init=False, repr=False, compare=False)
+    _hashed: int = field(init=False, repr=False, compare=False)
+    _hashed_from: tuple = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        self.model = _intern(self.model)
+        self._reset_hash()
+    
+    def _reset_hash(self) -> None:
+        # Running hash over (M, P₀, C₀), extended with each event
+        # the first time trace_hash() sees it.
+        self._hasher = hashlib.sha256(canonical_bytes({
+            "model": self.model,
+            "initial_context": self.initial_context,
+            "codebase_hash": self.codebase_hash,
+        }))
+        self._hashed = 0
+        # What the running hash was built from: the header, the events
+        # list object and the last event hashed
+        self._hashed_from = (
+            self.model, self.initial_context, self.codebase_hash, self.events, None
+        )
     
     def append(self, event: Event) -> None:
         """Append event to trace (monoid operation)."""
         self.events.append(event)
     
-    def to_dict(self) -> dict:
+    def trace_hash(self) -> str:
+        """
+        Hash of the reproducible content: model, initial context,
+        codebase hash and the ordered events. Session id and creation
+        time are excluded.
+        
+        Incremental: each event is serialized and hashed once, on the
+        first call after it was appended, not on every call. If the
+        header changed, or `events` was replaced or lost events, the
+        hash is rebuilt from scratch.
+        """
+        events = self.events
+        n = self._hashed
+        model, context, codebase, hashed_events, last = self._hashed_from
+        if (
+            events is not hashed_events
+            or len(events) < n
+            or (n and events[n - 1] is not last)
+            or (model, context, codebase)
+            != (self.model, self.initial_context, self.codebase_hash)
+        ):
+            self._reset_hash()
+            n = 0
+        for event in events[n:]:
+            self._hasher.update(event.canonical())
+        self._hashed = len(events)
+        self._hashed_from = (
+            self.model, self.initial_context, self.codebase_hash,
+            events, events[-1] if events else None,
+        )
+        return f"sha256:{self._hasher.copy().hexdigest()[:16]}"
+    
+    def __getstate__(self):
+        # hashlib objects can't be pickled; the running hash is rebuilt
+        return {**self.header_dict(), "events": self.events}
+    
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.__post_init__()
+    
+    def header_dict(self) -> dict:
+        """Session metadata without the event trace."""
         return {
             "session_id": self.session_id,
             "model": self.model,
             "codebase_hash": self.codebase_hash,
             "initial_context": self.initial_context,
             "created_at": self.created_at,
+        }
+    
+    def to_dict(self) -> dict:
+        return {
+            **self.header_dict(),
             "events": [e.to_dict() for e in self.events],
         }
     
     @classmethod
     def from_dict(cls, d: dict) -> "Session":
-        events = [Event.from_dict(e) for e in d.get("events", [])]
+        events = list(map(Event.from_dict, d.get("events") or ()))
         return cls(
             session_id=d["session_id"],
             model=d["model"],
@@ -74,6 +286,62 @@ class Session:
             created_at=d.get("created_at", ""),
             events=events,
         )
+    
+    def to_yaml(self) -> str:
+        """
+        Serialize the session as YAML-compatible text.
+        
+        Emits JSON (a subset of YAML) with sorted keys, which is much
+        faster to write and read back than block-style YAML. Characters
+        outside YAML's printable set (e.g. \\x7f, \\x85) are \\u-escaped so
+        YAML parsers read the strings back unchanged.
+        """
+        if orjson is not None:
+            text = orjson.dumps(
+                self.to_dict(), option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+            ).decode()
+        else:
+            text = json.dumps(self.to_dict(), sort_keys=True, ensure_ascii=False)
+        return escape_unsafe(text)
+    
+    @classmethod
+    def from_yaml(cls, text: str) -> "Session":
+        """Parse `to_yaml` output (JSON fast path) or any YAML document."""
+        try:
+            data = orjson.loads(text) if orjson is not None else json.loads(text)
+        except ValueError:
+            data = yaml.load(text, Loader=SafeLoader)
+        return cls.from_dict(data)
+
+
+def canonical_bytes(d: dict) -> bytes:
+    """
+    Deterministic encoding of a dict for hashing.
+    
+    Always stdlib json (sorted keys, compact), so digests don't depend
+    on which optional serializers are installed. Dicts mixing str and
+    non-str keys (which json can't sort) have their keys converted to
+    strings first, as json would when writing them.
+    """
+    try:
+        text = json.dumps(d, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    except TypeError:
+        text = json.dumps(
+            _str_keys(d), sort_keys=True, separators=(",", ":"), ensure_ascii=False
+        )
+    return text.encode() + b"\n"
+
+
+def _str_keys(value):
+    """Copy of value with every dict key converted the way json does."""
+    if isinstance(value, dict):
+        return {
+            (k if isinstance(k, str) else json.dumps(k)): _str_keys(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [_str_keys(v) for v in value]
+    return value
 
 
 def hash_content(content: str | bytes) -> str:
@@ -83,18 +351,112 @@ def hash_content(content: str | bytes) -> str:
     return f"sha256:{hashlib.sha256(content).hexdigest()[:16]}"
 
 
+def hash_content_batch(items: list[str | bytes]) -> str:
+    """
+    Single SHA256 over many items.
+    
+    Each item is length-prefixed so item boundaries are unambiguous.
+    Use when the caller needs one collision-resistant digest for the
+    whole batch rather than one digest per item.
+    """
+    h = hashlib.sha256()
+    for item in items:
+        if isinstance(item, str):
+            item = item.encode()
+        h.update(len(item).to_bytes(8, "little"))
+        h.update(item)
+    return f"sha256:{h.hexdigest()[:16]}"
+
+
+def _iter_files(path: str):
+    """
+    Yield non-hidden file entries under path, in sorted order.
+    
+    Like os.walk, directories that can't be listed are skipped.
+    """
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(
+                (e for e in it if not e.name.startswith('.')), key=lambda e: e.name
+            )
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir():
+            # Like os.walk: don't follow symlinked directories
+            if not entry.is_symlink():
+                yield from _iter_files(entry.path)
+        else:
+            yield entry
+
+
+# hashlib.file_digest (3.11+) hashes straight from the file descriptor
+_file_digest = getattr(hashlib, "file_digest", None)
+
+
+def _hash_file(fpath: str) -> bytes | None:
+    """SHA256 digest of one file, or None if it can't be read."""
+    try:
+        with open(fpath, 'rb', buffering=0) as fp:
+            if _file_digest is not None:
+                return _file_digest(fp, "sha256").digest()
+            h = hashlib.sha256()
+            buf = bytearray(HASH_CHUNK_SIZE)
+            view = memoryview(buf)
+            while n := fp.readinto(buf):
+                h.update(view[:n])
+    except OSError:
+        return None
+    return h.digest()
+
+
+def _hash_files(paths: list[str]) -> str:
+    """
+    Hash files, in the given order, into a single SHA256.
+    
+    Files are hashed concurrently (file reads and hashlib updates
+    release the GIL); the per-file digests are then combined in path
+    order so the result is deterministic.
+    """
+    workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = pool.map(_hash_file, paths)
+        manifest = b"".join(
+            os.fsencode(fpath) + b'\0' + digest + b'\n'
+            for fpath, digest in zip(paths, digests)
+            if digest is not None
+        )
+    return hash_content(manifest)
+
+
+# Directory hashes keyed by a digest of every file's (path, size, mtime)
+_DIR_HASH_CACHE: dict[str, str] = {}
+
+
 def hash_directory(path: str) -> str:
-    """Hash a directory's content (simplified: just hash file listing)."""
-    import os
-    parts = []
-    for root, dirs, files in os.walk(path):
-        dirs[:] = [d for d in dirs if not d.startswith('.')]
-        for f in sorted(files):
-            if not f.startswith('.'):
-                fpath = os.path.join(root, f)
-                try:
-                    with open(fpath, 'rb') as fp:
-                        parts.append(f"{fpath}:{hashlib.sha256(fp.read()).hexdigest()[:8]}")
-                except:
-                    pass
-    return hash_content("\n".join(parts))
+    """
+    Hash a directory's content.
+    
+    Memoized on a stat fingerprint of the tree: any added, removed,
+    resized or touched file changes the key, so an unchanged codebase
+    is only read once per process.
+    
+    Raises NotADirectoryError if path is missing or not a directory.
+    """
+    if not os.path.isdir(path):
+        raise NotADirectoryError(f"cannot hash {path!r}: not a directory")
+    paths = []
+    fingerprint = []
+    for entry in _iter_files(path):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        paths.append(entry.path)
+        fingerprint.append(f"{entry.path}\0{st.st_size}\0{st.st_mtime_ns}")
+    
+    key = hash_content_batch(fingerprint)
+    digest = _DIR_HASH_CACHE.get(key)
+    if digest is None:
+        digest = _DIR_HASH_CACHE[key] = _hash_files(paths)
+    return digest
@@ -7,10 +7,13 @@ Key properties to verify:
 3. Trace serialization roundtrips correctly
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import os
 import sys
 sys.path.insert(0, '.')
 
 from vtrace import Session, Event, Logger, Replayer, replay
+from vtrace.codec import read_session
 
 
 def test_session_roundtrip():
@@ -41,8 +44,84 @@ def test_session_roundtrip():
     print("✓ test_session_roundtrip")
 
 
+def test_session_yaml_roundtrip():
+    """to_yaml output is valid YAML and from_yaml restores the session."""
+    import yaml
+    
+    session = Session(session_id="y1", model="gpt-4", codebase_hash="none")
+    session.append(Event(type="edit", timestamp=1, input="a.py",
+                         output="+x = 1\n+y = 2", metadata={"k": [1, 2.5]}))
+    session.append(Event(type="tool_call", timestamp=2, input="cat",
+                         output="a\x7fb\x85c\u2028d", metadata={}))
+    
+    text = session.to_yaml()
+    assert yaml.safe_load(text) == session.to_dict()
+    assert Session.from_yaml(text) == session
+    
+    # Plain YAML input is still accepted
+    restored = Session.from_yaml(yaml.safe_dump(session.to_dict()))
+    assert restored.events[0].output == "+x = 1\n+y = 2"
+    
+    # Header-only reads see keys on both sides of `events`
+    from vtrace.codec import read_header
+    with open("/tmp/header_test.yaml", "w") as f:
+        f.write(text)
+    assert read_header("/tmp/header_test.yaml") == (session.header_dict(), 2)
+    print("✓ test_session_yaml_roundtrip")
+
+
+def test_session_pickle_roundtrip():
+    """Sessions and events pickle, dropping caches and rebuilding them."""
+    import pickle
+    
+    session = Session(session_id="p1", model="gpt-4", codebase_hash="none")
+    session.append(Event(type="llm_call", timestamp=1, input="p", output="r", metadata={}))
+    hash1 = session.trace_hash()
+    
+    restored = pickle.loads(pickle.dumps(session))
+    assert restored == session
+    assert restored.trace_hash() == hash1
+    restored.append(Event(type="edit", timestamp=2, input="a.py", output="+x", metadata={}))
+    assert restored.trace_hash() != hash1
+    print("✓ test_session_pickle_roundtrip")
+
+
+def test_trace_hash():
+    """trace_hash tracks appends and survives serialization."""
+    session = Session(session_id="h1", model="test", codebase_hash="none")
+    session.append(Event(type="llm_call", timestamp=1, input="p", output="r", metadata={}))
+    hash1 = session.trace_hash()
+    assert hash1 == session.trace_hash()
+    
+    # Session id is not part of the reproducible content
+    other = Session.from_dict({**session.to_dict(), "session_id": "h2"})
+    assert other.trace_hash() == hash1
+    
+    session.append(Event(type="llm_call", timestamp=2, input="p2", output="r2", metadata={}))
+    assert session.trace_hash() != hash1
+    
+    # Direct edits to the events list are picked up
+    event2 = session.events.pop()
+    assert session.trace_hash() == hash1
+    session.append(Event(type="edit", timestamp=2, input="a.py", output="+x", metadata={}))
+    hash3 = session.trace_hash()
+    session.events[-1] = event2
+    session.events = list(session.events)
+    fresh = Session(session_id="h3", model="test", codebase_hash="none",
+                    events=list(session.events))
+    assert session.trace_hash() == fresh.trace_hash() != hash3
+    
+    # Mixed str/int keys (writable by every codec) can be hashed
+    session.append(Event(type="tool_call", timestamp=3, input={"tool": "t", "args": {1: "a", "b": 2}},
+                         output="", metadata={}))
+    assert session.trace_hash() != fresh.trace_hash()
+    print("✓ test_trace_hash")
+
+
 def test_replay_determinism():
     """Same trace replays to same state."""
+    import pickle
+    
     session = Session(
         session_id="det_test",
         model="test",
@@ -67,11 +146,128 @@ def test_replay_determinism():
     state1 = replay(session)
     state2 = replay(session)
     
-    assert state1.files == state2.files
-    assert state1.llm_outputs == state2.llm_outputs
+    assert state1.state_hash() == state2.state_hash()
+    assert state1.files["file.py"] == "print('hello')"
+    
+    # A replayed state survives a pickle roundtrip (e.g. to a worker)
+    restored = pickle.loads(pickle.dumps(state1, protocol=5))
+    assert restored.state_hash() == state1.state_hash()
+    
+    state2.set_file("file.py", "print('bye')")
+    assert state1.state_hash() != state2.state_hash()
     print("✓ test_replay_determinism")
 
 
+def test_replay_to_seek():
+    """Seeking backwards and forwards matches a fresh replay."""
+    session = Session(session_id="seek", model="test", codebase_hash="none")
+    for i in range(50):
+        session.append(Event(type="edit", timestamp=i, input=f"f{i % 3}.py",
+                             output=f"+v{i}", metadata={}))
+        session.append(Event(type="llm_call", timestamp=i, input="p",
+                             output=f"r{i}", metadata={}))
+    
+    with Replayer(session, checkpoint_interval=8) as r:
+        for index in (90, 17, 64, 3, 100, 0):
+            state = r.replay_to(index)
+            with Replayer(session) as fresh:
+                expected = fresh.replay_to(index)
+                assert state.files == expected.files
+                assert state.llm_outputs == expected.llm_outputs
+                assert state.event_index == index
+        
+        r.replay_all()
+        assert r.replay_to(-1).event_index == 0
+        assert r.state.files == {} and r.state.llm_outputs == []
+    print("✓ test_replay_to_seek")
+
+
+def test_replay_workspace_flush():
+    """Seeking back removes files created later from the workspace."""
+    from pathlib import Path
+    import shutil
+    import tempfile
+    from vtrace.replayer import ReplayState
+    
+    session = Session(session_id="ws", model="test", codebase_hash="none")
+    session.append(Event(type="edit", timestamp=1, input="a.py", output="+a = 1", metadata={}))
+    session.append(Event(type="edit", timestamp=2, input="pkg/b.py", output="+b = 1", metadata={}))
+    session.append(Event(type="edit", timestamp=3, input="a.py", output="+a = 2", metadata={}))
+    
+    workspace = Path(tempfile.mkdtemp(prefix="vtrace_test_"))
+    try:
+        with Replayer(session, workspace=workspace, checkpoint_interval=1) as r:
+            r.replay_all()
+            assert (workspace / "pkg/b.py").read_text() == "b = 1"
+            assert (workspace / "a.py").read_text() == "a = 2"
+            
+            state = r.replay_to(1)
+            assert state == ReplayState(workspace=workspace, files={"a.py": "a = 1"},
+                                        event_index=1)
+        assert not (workspace / "pkg/b.py").exists()
+        assert (workspace / "a.py").read_text() == "a = 1"
+    finally:
+        shutil.rmtree(workspace)
+    print("✓ test_replay_workspace_flush")
+
+
+def test_compare_traces():
+    """compare_traces reports type and output mismatches by index."""
+    from vtrace import compare_traces
+    
+    def make(outputs, hashed=True):
+        with Logger(Session(session_id="c", model="test", codebase_hash="none")) as logger:
+            for kind, output in outputs:
+                if kind == "edit":
+                    logger.log_edit(file_path="a.py", diff=output, content_hash="bogus")
+                else:
+                    logger.log_tool_call(tool_name="ls", args=".", output=output)
+        if not hashed:
+            for event in logger.session.events:
+                del event.metadata["content_hash"]
+        return logger.session
+    
+    base = [("edit", "+x"), ("tool", "a"), ("tool", "b")]
+    for hashed in (True, False):
+        assert compare_traces(make(base, hashed), make(base, hashed))["event_diffs"] == []
+        
+        diffs = compare_traces(
+            make(base, hashed),
+            make([("edit", "+x"), ("edit", "a"), ("tool", "c"), ("tool", "d")], hashed),
+        )
+        assert diffs["event_count"] == (3, 4)
+        assert diffs["event_diffs"] == [
+            {"index": 1, "type": "type_mismatch", "values": ("tool_call", "edit")},
+            {"index": 2, "type": "output_mismatch", "event_type": "tool_call"},
+        ]
+    
+    # One side without a hash falls back to comparing outputs
+    assert compare_traces(make(base), make(base, hashed=False))["event_diffs"] == []
+    
+    # Caller metadata can't override the logged digest
+    assert make(base).events[0].metadata["content_hash"] != "bogus"
+    print("✓ test_compare_traces")
+
+
+def test_llm_response_lookup():
+    """Recorded LLM responses can be looked up by prompt."""
+    session = Session(session_id="llm", model="test", codebase_hash="none")
+    session.append(Event(type="llm_call", timestamp=1, input="2+2?", output="4",
+                         metadata={"temperature": 0.0}))
+    session.append(Event(type="llm_call", timestamp=2, input="3+3?", output="6",
+                         metadata={"temperature": 0.7}))
+    session.append(Event(type="llm_call", timestamp=3, input="1+1?", output="2",
+                         metadata={"temperature": 0}))
+    
+    with Replayer(session) as r:
+        assert r.llm_response("2+2?") == "4"
+        assert r.llm_response("3+3?", temperature=0.7) == "6"
+        assert r.llm_response("3+3?") is None
+        assert r.llm_response("1+1?") == "2"
+        assert r.llm_response("2+2?", temperature=0) == "4"
+    print("✓ test_llm_response_lookup")
+
+
 def test_event_ordering():
     """Events maintain order."""
     logger = Logger.new_session(model="test", trace_file="/tmp/test_order.yaml")
@@ -101,12 +297,74 @@ def test_empty_session():
     print("✓ test_empty_session")
 
 
+def test_hash_directory():
+    """Directory hashes are stable, content-based and order-independent."""
+    import shutil
+    import tempfile
+    from vtrace import hash_directory
+    
+    def make(root, names):
+        for name in names:
+            fpath = os.path.join(root, name)
+            os.makedirs(os.path.dirname(fpath), exist_ok=True)
+            with open(fpath, "w") as f:
+                f.write(f"content of {name}\n")
+    
+    names = ["a.py", "pkg/b.py", "pkg/sub/c.py", "z.txt"]
+    root1 = tempfile.mkdtemp(prefix="vtrace_hash_")
+    try:
+        make(root1, names)
+        digest = hash_directory(root1)
+        assert hash_directory(root1) == digest
+        
+        # Rebuilding the same tree in another order gives the same digest
+        shutil.rmtree(root1)
+        make(root1, reversed(names))
+        assert hash_directory(root1) == digest
+        
+        # Hidden files and directories are ignored
+        make(root1, [".git/HEAD", ".env"])
+        assert hash_directory(root1) == digest
+        
+        # Unreadable subdirectories are skipped; bad roots are rejected
+        locked = os.path.join(root1, "locked")
+        os.mkdir(locked, 0)
+        try:
+            hash_directory(root1)
+        finally:
+            os.chmod(locked, 0o700)
+            os.rmdir(locked)
+        for bad in (os.path.join(root1, "missing"), os.path.join(root1, "a.py")):
+            try:
+                hash_directory(bad)
+            except NotADirectoryError:
+                pass
+            else:
+                raise AssertionError(f"expected NotADirectoryError for {bad}")
+        
+        # Touching a file recomputes the digest but keeps the same value
+        target = os.path.join(root1, "pkg/b.py")
+        st = os.stat(target)
+        os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert hash_directory(root1) == digest
+        
+        # Same-size edit with a new mtime yields a new digest
+        with open(target, "w") as f:
+            f.write("content of pkg/X.py\n")
+        os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+        assert hash_directory(root1) != digest
+    finally:
+        shutil.rmtree(root1)
+    print("✓ test_hash_directory")
+
+
 def test_logger_persistence():
     """Logger saves to file correctly."""
     import yaml
     
     logger = Logger.new_session(model="gpt-4", trace_file="/tmp/persist_test.yaml")
     logger.log_llm_call(prompt="test", response="result")
+    logger.close()
     
     # Load and verify
     with open("/tmp/persist_test.yaml") as f:
@@ -117,13 +375,176 @@ def test_logger_persistence():
     print("✓ test_logger_persistence")
 
 
+def test_logger_unencodable_event():
+    """An event that can't be encoded raises at the call, not later."""
+    with Logger.new_session(model="test", trace_file="/tmp/unencodable_test.yaml") as logger:
+        logger.log_tool_call(tool_name="ls", args=".", output="a")
+        try:
+            logger.log_tool_call(tool_name="ls", args=".", output="b", extra=object())
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("expected TypeError")
+        logger.log_tool_call(tool_name="ls", args=".", output="c")
+        logger.flush()
+    
+    session = read_session("/tmp/unencodable_test.yaml")
+    assert [e.output for e in session.events] == ["a", "c"]
+    
+    # A closed logger refuses new events instead of keeping them in memory only
+    try:
+        logger.log_tool_call(tool_name="ls", args=".", output="d")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("expected ValueError")
+    assert len(logger.session.events) == 2
+    print("✓ test_logger_unencodable_event")
+
+
+def test_logger_append_reload():
+    """Appended events survive reload and further appends."""
+    with Logger.new_session(model="test", trace_file="/tmp/append_test.yaml") as logger:
+        for i in range(40):
+            logger.log_tool_call(tool_name="echo", args=str(i), output=f"out {i}\n")
+    
+    with Logger.load("/tmp/append_test.yaml") as logger:
+        assert logger.event_count == 40
+        logger.log_edit(file_path="a.py", diff="+x = 1")
+    
+    session = read_session("/tmp/append_test.yaml")
+    assert len(session.events) == 41
+    assert session.events[39].output == "out 39\n"
+    assert session.events[40].input == "a.py"
+    print("✓ test_logger_append_reload")
+
+
+def test_fastyaml_roundtrip():
+    """Fast event emitter output loads back to the same dict."""
+    import yaml
+    from vtrace._fastyaml import dump_event
+    
+    event = {
+        "type": "tool_call",
+        "timestamp": "2024-01-01T00:00:00",
+        "input": {"tool": "sh", "args": ["-c", "yes"]},
+        "output": "line 1\n  indented: yes\n\n- not a list\n\n",
+        "metadata": {"exit": 0, "ratio": 1e-05, "ok": True, "note": None, "raw": "a\r\x85b"},
+    }
+    buf = bytearray(b"events:\n")
+    dump_event(event, buf)
+    assert yaml.safe_load(buf.decode())["events"] == [event]
+    print("✓ test_fastyaml_roundtrip")
+
+
+def test_jsonl_trace():
+    """Traces with a .jsonl suffix roundtrip through the JSON-lines codec."""
+    with Logger.new_session(model="test", trace_file="/tmp/codec_test.jsonl") as logger:
+        logger.log_llm_call(prompt="p", response="r\nmore", temperature=0.3)
+        logger.log_tool_call(tool_name="ls", args={"path": "."}, output="a.py")
+        # Non-string keys are written as strings, with or without orjson
+        logger.log_tool_call(tool_name="wc", args={1: "a"}, output="1")
+    
+    with open("/tmp/codec_test.jsonl") as f:
+        assert len(f.readlines()) == 4
+    
+    session = read_session("/tmp/codec_test.jsonl")
+    assert session.model == "test"
+    assert session.events[0].output == "r\nmore"
+    assert session.events[1].input == {"tool": "ls", "args": {"path": "."}}
+    # Decoded type and tool name strings are interned
+    assert session.events[1].type is session.events[2].type
+    assert session.events[2].input["tool"] is sys.intern("wc")
+    assert session.events[2].input["args"] == {"1": "a"}
+    print("✓ test_jsonl_trace")
+
+
+def test_write_session():
+    """write_session output loads back in every text format."""
+    from vtrace.codec import write_session
+    
+    session = Session(session_id="w1", model="test", codebase_hash="none")
+    session.append(Event(type="edit", timestamp=1, input="a.py", output="+x = 1\n", metadata={}))
+    session.append(Event(type="llm_call", timestamp=2, input="p", output="r", metadata={"temperature": 0.5}))
+    
+    for path in ("/tmp/write_test.yaml", "/tmp/write_test.jsonl"):
+        write_session(path, session)
+        assert read_session(path) == session
+    
+    # Cached reloads are independent sessions, down to nested dicts
+    loaded = read_session("/tmp/write_test.jsonl")
+    loaded.events[1].metadata["note"] = "changed"
+    assert "note" not in read_session("/tmp/write_test.jsonl").events[1].metadata
+    
+    # ...and see rewrites
+    loaded = read_session("/tmp/write_test.jsonl")
+    loaded.append(Event(type="edit", timestamp=3, input="b.py", output="+y", metadata={}))
+    assert len(read_session("/tmp/write_test.jsonl").events) == 2
+    write_session("/tmp/write_test.jsonl", loaded)
+    assert read_session("/tmp/write_test.jsonl") == loaded
+    
+    # Concurrent durable writers each use their own temp file
+    import glob
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: write_session("/tmp/write_test.yaml", loaded, durable=True), range(8)))
+    assert read_session("/tmp/write_test.yaml") == loaded
+    assert not glob.glob("/tmp/.write_test.yaml.*.tmp")
+    print("✓ test_write_session")
+
+
+def test_msgpack_trace():
+    """Traces with a .mpk suffix roundtrip through the msgpack codec."""
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        print("- test_msgpack_trace (skipped: msgpack not installed)")
+        return
+    from vtrace.codec import read_header
+    
+    with Logger.new_session(model="test", trace_file="/tmp/codec_test.mpk") as logger:
+        logger.log_llm_call(prompt="p", response="r\nmore", temperature=0.3)
+        logger.log_edit(file_path="a.py", diff="+x = 1")
+        logger.log_tool_call(tool_name="wc", args={1: "a"}, output="1")
+    
+    header, count = read_header("/tmp/codec_test.mpk")
+    assert header["model"] == "test" and count == 3
+    
+    session = read_session("/tmp/codec_test.mpk")
+    assert session.events[0].output == "r\nmore"
+    assert session.events[0].metadata["temperature"] == 0.3
+    assert session.events[1].input == "a.py"
+    assert session.events[2].input["args"] == {1: "a"}
+    print("✓ test_msgpack_trace")
+
+
 def run_all():
     print("Running vtrace tests...\n")
-    test_session_roundtrip()
-    test_replay_determinism()
-    test_event_ordering()
-    test_empty_session()
-    test_logger_persistence()
+    tests = [
+        test_session_roundtrip,
+        test_session_yaml_roundtrip,
+        test_session_pickle_roundtrip,
+        test_trace_hash,
+        test_replay_determinism,
+        test_replay_to_seek,
+        test_replay_workspace_flush,
+        test_compare_traces,
+        test_llm_response_lookup,
+        test_event_ordering,
+        test_empty_session,
+        test_hash_directory,
+        test_logger_persistence,
+        test_logger_unencodable_event,
+        test_logger_append_reload,
+        test_fastyaml_roundtrip,
+        test_jsonl_trace,
+        test_write_session,
+        test_msgpack_trace,
+    ]
+    # Tests share no state (each uses its own trace file or temp
+    # workspace), so run them concurrently; map() re-raises the first
+    # failure.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        list(pool.map(lambda test: test(), tests))
     print("\nAll tests passed!")
 
 